@@ -18,211 +18,274 @@ import requests
 import zipfile
 import shutil
 import hashlib
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
-from datetime import datetime
+from typing import Iterable, Iterator, NamedTuple
+from requests.adapters import HTTPAdapter
+from requests_toolbelt.multipart.encoder import MultipartEncoder
+from urllib3.util.retry import Retry
+
+try:
+    import inotify.adapters
+    import inotify.calls
+    import inotify.constants
+except ImportError:
+    inotify = None
 
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(levelname)s - %(message)s'
 )
 logger = logging.getLogger(__name__)
+# inotify logs a warning for every directory that vanishes mid-walk (our own cleanup)
+logging.getLogger('inotify').setLevel(logging.ERROR)
 
 # Supported file extensions
 IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.heif', '.tiff', '.tif', '.bmp', '.raw', '.arw', '.cr2', '.nef', '.orf', '.raf', '.dng'}
 VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm', '.m4v', '.3gp', '.mts', '.m2ts', '.mpg', '.mpeg'}
-SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
+# Matched as lower_suffix(name) in SUPPORTED_EXTENSIONS: one hash lookup, and any letter case
+# (name.endswith() over a tuple of every spelling measured slower and misses e.g. '.Jpg')
+SUPPORTED_EXTENSIONS: frozenset[str] = frozenset(IMAGE_EXTENSIONS | VIDEO_EXTENSIONS)
 
 # How long a file must be unchanged before processing (seconds)
 FILE_STABILITY_SECONDS = 5
 
-# Files/patterns to remove from Google Takeout
-TAKEOUT_JUNK_FILES = {
-    'archive_browser.html',
-    'print-subscriptions.json',
-    'shared_album_comments.json',
-    'user-generated-memory-titles.json',
-    'metadata.json',
+# Directories never worth descending into (NAS thumbnails, sync tool state, recycle bins)
+SKIP_DIR_NAMES = {'.thumbnails', '@eaDir', '.stfolder', '.AppleDouble', '.Trashes', '#recycle'}
+
+# Stop walking a tree after this many directories (guards against runaway trees)
+MAX_WALK_DIRS = 50000
+
+# How many files to upload at once (each upload holds one connection and one open file)
+CONCURRENT_UPLOADS = max(1, int(os.environ.get('IMPORT_CONCURRENT_UPLOADS', os.cpu_count() or 4)))
+
+# ZIP bomb limits: total bytes a ZIP may expand to (0 = no fixed cap, ratio checks only),
+# and the most any single media member may expand over its compressed size
+MAX_EXTRACT_BYTES = int(os.environ.get('IMPORT_MAX_EXTRACT_BYTES', 0))
+MAX_MEMBER_RATIO = 1000
+
+# Upload form fields that are the same for every file
+_UPLOAD_FIELDS = {
+    'deviceId': 'import-watch',
+    'isFavorite': 'false'
 }
 
+# User name -> Immich API key, from IMPORT_USER_<NAME> env vars (fixed for the process lifetime)
+USER_ENV_PREFIX = 'IMPORT_USER_'
+USERS = {
+    key[len(USER_ENV_PREFIX):].lower(): value
+    for key, value in os.environ.items()
+    if key.startswith(USER_ENV_PREFIX) and value
+}
+
+# libyaml-backed loader when PyYAML was built with it, pure-Python otherwise
+YAML_LOADER = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+
+# Bytes handed to the socket per write when streaming an upload body
+UPLOAD_BLOCKSIZE = 1024 * 1024
+
+
+class UploadAdapter(HTTPAdapter):
+    """HTTPAdapter whose connections stream request bodies in UPLOAD_BLOCKSIZE reads
+    (http.client's default is 8-16KB, i.e. hundreds of thousands of encoder reads per GB)."""
+    
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault('blocksize', UPLOAD_BLOCKSIZE)
+        super().init_poolmanager(*args, **kwargs)
+
+
+# Shared HTTP session so uploads reuse keep-alive connections instead of a new TCP/TLS
+# handshake per file. API keys are sent per request, so one session serves every user.
+# Every request here is a POST, so only failed connection attempts are retried (nothing of
+# the streamed body has been sent yet); error statuses and failed reads are left to the caller.
+# Users scan in parallel, each with its own upload pool plus a bulk check running
+# alongside it, so size for all of them.
+SESSION = requests.Session()
+_adapter = UploadAdapter(
+    pool_connections=CONCURRENT_UPLOADS,
+    pool_maxsize=(CONCURRENT_UPLOADS + 1) * max(1, len(USERS)),
+    max_retries=Retry(total=3, read=0, backoff_factor=0.5)
+)
+SESSION.mount('http://', _adapter)
+SESSION.mount('https://', _adapter)
+
+# Bytes of files hashed, checked and uploaded together; small enough to stay in the page cache
+CHECK_BATCH_BYTES = 512 * 1024 * 1024
+
+# inotify events that mean a file has finished landing in a watch folder
+INOTIFY_FILE_EVENTS = {'IN_CLOSE_WRITE', 'IN_MOVED_TO'}
+
+# Import queued files after this much quiet, or at least this often during a long burst
+INOTIFY_QUIET_SECONDS = 1.0
+INOTIFY_MAX_BATCH_SECONDS = 30
+
 
 def load_config(config_path: str) -> dict:
     """Load configuration from YAML file."""
     with open(config_path, 'r') as f:
-        return yaml.safe_load(f)
+        return yaml.load(f, Loader=YAML_LOADER)
 
 
 def get_users_from_env() -> dict:
     """Load user mappings from IMPORT_USER_* environment variables."""
-    users = {}
-    prefix = 'IMPORT_USER_'
-    
-    for key, value in os.environ.items():
-        if key.startswith(prefix) and value:
-            username = key[len(prefix):].lower()
-            users[username] = value
-            
-    return users
+    return USERS
 
 
-def is_file_stable(file_path: Path, stability_seconds: int = FILE_STABILITY_SECONDS) -> bool:
-    """Check if a file has stopped being written to (size unchanged for stability_seconds)."""
+def is_file_stable(file_path: Path, stability_seconds: int = FILE_STABILITY_SECONDS,
+                   initial_stat: os.stat_result | None = None) -> bool:
+    """
+    Check if a file has stopped being written to (size unchanged for stability_seconds).
+    Pass initial_stat (e.g. from walk_once) to skip the first stat.
+    """
     try:
-        if not file_path.exists():
-            return False
-        
-        initial_size = file_path.stat().st_size
-        initial_mtime = file_path.stat().st_mtime
+        # A missing file raises FileNotFoundError (an OSError), so no separate exists() check
+        if initial_stat is None:
+            initial_stat = os.stat(file_path)
         
         # If file was modified very recently, it might still be copying
-        if time.time() - initial_mtime < stability_seconds:
+        if time.time() - initial_stat.st_mtime < stability_seconds:
             return False
         
         # Double-check by waiting a moment and comparing
         time.sleep(1)
+        current = os.stat(file_path)
         
-        if not file_path.exists():
-            return False
-            
-        current_size = file_path.stat().st_size
-        
-        # Size changed = still copying
-        if current_size != initial_size:
+        # Size or mtime changed = still copying
+        if current.st_size != initial_stat.st_size or current.st_mtime != initial_stat.st_mtime:
             return False
         
         # File with 0 bytes is likely still being created
-        if current_size == 0:
+        if current.st_size == 0:
             return False
             
         return True
         
-    except (OSError, IOError):
+    except OSError:
         return False
 
 
-def is_google_takeout(extract_dir: Path) -> bool:
-    """Check if an extracted directory is a Google Takeout export."""
-    # Check for typical Takeout structure
-    if (extract_dir / 'Takeout').exists():
-        return True
-    if (extract_dir / 'Google Photos').exists():
-        return True
-    
-    # Check for JSON metadata files alongside photos (Takeout pattern)
-    json_files = list(extract_dir.rglob('*.json'))[:10]  # Sample first 10
-    if json_files:
-        media_files = list(extract_dir.rglob('*.jpg'))[:5] + list(extract_dir.rglob('*.mp4'))[:5]
-        if media_files:
-            # Check if JSON files follow Takeout naming pattern (e.g., IMG_1234.jpg.json)
-            for json_file in json_files:
-                if json_file.stem.endswith(('.jpg', '.jpeg', '.png', '.heic', '.mp4', '.mov')):
-                    return True
-    
-    return False
+def lower_suffix(name: str) -> str:
+    """Lowercased extension of a file name including the dot ('' if none), without building a Path."""
+    _, dot, ext = name.rpartition('.')
+    return '.' + ext.lower() if dot else ''
+
 
+class Entry(NamedTuple):
+    """One importable media file found by walk_once."""
+    path: Path
+    stat: os.stat_result
 
-def cleanup_google_takeout(extract_dir: Path) -> int:
+
+def walk_once(root: Path) -> Iterator[Entry]:
     """
-    Clean up a Google Takeout export:
-    - Remove JSON metadata files
-    - Remove junk files
-    - Flatten directory structure
-    Returns the number of media files found.
+    Walk a directory tree once with os.scandir, yielding the importable media files under it.
+    Names are checked before anything else, so other files cost no stat and no Path object;
+    file stats come from the DirEntry, so each inode is stat'd at most once per walk.
     """
-    logger.info(f"  Cleaning up Google Takeout export...")
-    
-    # Find the actual photos directory
-    photos_dir = extract_dir
-    if (extract_dir / 'Takeout' / 'Google Photos').exists():
-        photos_dir = extract_dir / 'Takeout' / 'Google Photos'
-    elif (extract_dir / 'Takeout').exists():
-        photos_dir = extract_dir / 'Takeout'
-    elif (extract_dir / 'Google Photos').exists():
-        photos_dir = extract_dir / 'Google Photos'
+    stack = [str(root)]
+    walked_dirs = 0
     
-    # Remove JSON metadata files
-    json_count = 0
-    for json_file in photos_dir.rglob('*.json'):
+    while stack:
+        walked_dirs += 1
+        if walked_dirs > MAX_WALK_DIRS:
+            logger.warning(f"Stopped walking {root} after {MAX_WALK_DIRS} directories, some files were not scanned")
+            break
         try:
-            json_file.unlink()
-            json_count += 1
+            with os.scandir(stack.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if entry.name not in SKIP_DIR_NAMES:
+                                stack.append(entry.path)
+                            continue
+                        if is_importable(entry.name, lower_suffix(entry.name)) and entry.is_file(follow_symlinks=False):
+                            yield Entry(Path(entry.path), entry.stat(follow_symlinks=False))
+                    except OSError:
+                        continue  # Vanished mid-walk
         except OSError:
-            pass
-    logger.info(f"  Removed {json_count} JSON metadata files")
-    
-    # Remove known junk files
-    for junk_file in extract_dir.rglob('*'):
-        if junk_file.name in TAKEOUT_JUNK_FILES:
-            try:
-                junk_file.unlink()
-            except OSError:
-                pass
+            continue
+
+
+def filter_stable(entries: list[Entry], stability_seconds: int = FILE_STABILITY_SECONDS) -> tuple[list[Entry], int]:
+    """
+    Batch version of is_file_stable for walked files: snapshot every file, sleep once,
+    and keep those whose size and mtime didn't change. Returns (stable entries, skipped count).
+    """
+    now = time.time()
+    stable = []
+    skipped = 0
     
-    # Collect all media files
-    media_files = []
-    for ext in SUPPORTED_EXTENSIONS:
-        media_files.extend(photos_dir.rglob(f'*{ext}'))
-        media_files.extend(photos_dir.rglob(f'*{ext.upper()}'))
-    
-    # Move media files to extract_dir root (flatten structure)
-    moved_count = 0
-    for media_file in media_files:
-        if media_file.parent == extract_dir:
-            continue  # Already in root
-        
-        target = extract_dir / media_file.name
-        
-        # Handle duplicate filenames
-        if target.exists():
-            counter = 1
-            stem = media_file.stem
-            suffix = media_file.suffix
-            while target.exists():
-                target = extract_dir / f"{stem}_{counter}{suffix}"
-                counter += 1
-        
-        try:
-            shutil.move(str(media_file), str(target))
-            moved_count += 1
-        except OSError as e:
-            logger.warning(f"  Failed to move {media_file.name}: {e}")
+    # If file was modified very recently, it might still be copying
+    candidates = []
+    for entry in entries:
+        if now - entry.stat.st_mtime < stability_seconds:
+            logger.debug("Skipping (still copying): %s", entry.path.name)
+            skipped += 1
+        else:
+            candidates.append(entry)
     
-    if moved_count > 0:
-        logger.info(f"  Moved {moved_count} files to root directory")
+    if not candidates:
+        return stable, skipped
     
-    # Clean up empty directories and Takeout structure
-    if photos_dir != extract_dir and photos_dir.exists():
-        try:
-            shutil.rmtree(photos_dir)
-        except OSError:
-            pass
+    # One wait for the whole batch instead of one per file
+    time.sleep(1)
     
-    # Remove Takeout directory if it still exists
-    takeout_dir = extract_dir / 'Takeout'
-    if takeout_dir.exists():
+    for entry in candidates:
         try:
-            shutil.rmtree(takeout_dir)
+            st = os.stat(entry.path)
         except OSError:
-            pass
-    
-    # Remove any remaining empty directories
-    for dir_path in sorted(extract_dir.rglob('*'), reverse=True):
-        if dir_path.is_dir():
-            try:
-                dir_path.rmdir()  # Only removes if empty
-            except OSError:
-                pass
-    
-    # Count remaining media files
-    final_count = sum(1 for f in extract_dir.iterdir() if f.is_file() and f.suffix.lower() in SUPPORTED_EXTENSIONS)
-    logger.info(f"  Google Takeout cleanup complete. {final_count} media files ready.")
+            skipped += 1
+            continue
+        
+        # Size/mtime changed = still copying; 0 bytes = likely still being created
+        if st.st_size != entry.stat.st_size or st.st_mtime != entry.stat.st_mtime or st.st_size == 0:
+            logger.debug("Skipping (still copying): %s", entry.path.name)
+            skipped += 1
+            continue
+        
+        stable.append(entry)
     
-    return final_count
+    return stable, skipped
+
+
+# SHA1 of files we extracted ourselves (path string -> checksum), computed while
+# writing them; dropped once the file is in Immich. Lost on restart, which only costs a re-hash.
+extracted_hashes: dict[str, str] = {}
+
+
+class ZipBombError(Exception):
+    """A ZIP expands far beyond its own size (extreme compression ratio)."""
+
+
+def extract_members(zip_path: str, jobs: list[tuple[str, str]]) -> dict[str, str]:
+    """
+    Extract (member name, target path) pairs from a ZIP. Runs in a worker thread, so it
+    opens its own ZipFile handle (ZipFile isn't safe to share across threads).
+    Returns {target path: SHA1} of what was written, hashed on the way through
+    so the duplicate check doesn't have to read it back.
+    """
+    checksums = {}
+    with zipfile.ZipFile(zip_path, 'r') as zf:
+        for member, target in jobs:
+            sha1 = hashlib.new('sha1', usedforsecurity=False)
+            with zf.open(member) as src, open(target, 'wb') as dst:
+                while chunk := src.read(1024 * 1024):
+                    sha1.update(chunk)
+                    dst.write(chunk)
+            checksums[target] = sha1.hexdigest()
+    return checksums
 
 
 def extract_zip_file(zip_path: Path, user_dir: Path) -> Path | None:
     """
-    Extract a ZIP file to a subdirectory.
-    Returns the extraction directory path, or None if extraction failed.
+    Extract the media files in a ZIP file into a flat subdirectory.
+    JSON sidecars, Takeout junk and other non-media members are never written,
+    and folder structure is dropped (duplicate names get a _1, _2, ... suffix).
+    Returns the extraction directory path (not created if the ZIP has no media),
+    or None if extraction failed.
     """
     extract_dir = user_dir / f"_extracted_{zip_path.stem}_{int(time.time())}"
     
@@ -234,24 +297,96 @@ def extract_zip_file(zip_path: Path, user_dir: Path) -> Path | None:
             # Don't log as error - file is likely still uploading
             # The stability check passed but ZIP end-of-central-directory isn't written yet
             size_str = f"{file_size / (1024*1024*1024):.2f} GB" if file_size > 1024*1024*1024 else f"{file_size / (1024*1024):.1f} MB"
-            logger.debug(f"Skipping ZIP (not yet valid, possibly still uploading): {zip_path.name} ({size_str})")
+            logger.debug("Skipping ZIP (not yet valid, possibly still uploading): %s (%s)", zip_path.name, size_str)
             return None
         size_str = f"{file_size / (1024*1024*1024):.2f} GB" if file_size > 1024*1024*1024 else f"{file_size / (1024*1024):.1f} MB"
         logger.info(f"Extracting: {zip_path.name} ({size_str})")
         
+        with zipfile.ZipFile(zip_path, 'r') as zf:
+            # Decide every member's flattened target up front
+            jobs = []
+            taken = set()
+            next_suffix = {}
+            uncompressed = 0
+            is_takeout = False
+            # Walk members in the order they sit in the archive, not central-directory order
+            for info in sorted(zf.infolist(), key=lambda i: i.header_offset):
+                if info.is_dir():
+                    continue
+                if info.filename.startswith(('Takeout/', 'Google Photos/')):
+                    is_takeout = True
+                # Only the base name is used, so '../' or absolute member paths can't escape
+                # extract_dir (a bare '..' is dot-prefixed and rejected by is_importable)
+                name = Path(info.filename).name
+                # One suffix lookup classifies every member: JSON sidecars and Takeout extras
+                # (archive_browser.html, print-subscriptions.json, ...) are simply not media
+                if not is_importable(name, lower_suffix(name)):
+                    continue
+                
+                # Handle duplicate filenames, resuming from the last suffix used for this name
+                # so thousands of IMG_0001.JPGs don't each re-probe _1, _2, ...
+                target_name = name
+                if target_name in taken:
+                    counter = next_suffix.get(name, 1)
+                    stem, suffix = os.path.splitext(name)
+                    while target_name in taken:
+                        target_name = f"{stem}_{counter}{suffix}"
+                        counter += 1
+                    next_suffix[name] = counter
+                taken.add(target_name)
+                
+                # Check for zip bombs over what we'll actually write, before anything is decompressed.
+                # The central directory sizes can be trusted: zipfile never yields more than file_size.
+                if info.file_size > max(info.compress_size, 1) * MAX_MEMBER_RATIO:
+                    raise ZipBombError(f"{name} expands {info.file_size // max(info.compress_size, 1)}x")
+                uncompressed += info.file_size
+                if uncompressed > file_size * 100 and uncompressed > 10 * 1024 * 1024 * 1024:  # 100x ratio and > 10GB
+                    raise ZipBombError(f"expands to over {uncompressed / (1024*1024*1024):.0f} GB")
+                if MAX_EXTRACT_BYTES and uncompressed > MAX_EXTRACT_BYTES:
+                    raise ZipBombError(
+                        f"expands to over {uncompressed / (1024*1024*1024):.1f} GB "
+                        f"(IMPORT_MAX_EXTRACT_BYTES is {MAX_EXTRACT_BYTES / (1024*1024*1024):.1f} GB)")
+                
+                jobs.append((info.filename, str(extract_dir / target_name)))
+        
+        if is_takeout:
+            logger.info("  Detected Google Takeout export")
+        
+        if not jobs:
+            logger.info(f"  No media files in {zip_path.name}")
+            return extract_dir
+        
         extract_dir.mkdir(parents=True, exist_ok=True)
         
-        with zipfile.ZipFile(zip_path, 'r') as zf:
-            # Check for zip bombs (extreme compression ratio)
-            total_size = sum(info.file_size for info in zf.infolist())
-            if total_size > file_size * 100 and total_size > 10 * 1024 * 1024 * 1024:  # 100x ratio and > 10GB
-                logger.warning(f"Suspicious compression ratio in {zip_path.name}, proceeding with caution")
-            
-            zf.extractall(extract_dir)
+        # Each member is an independent DEFLATE stream, so spread them across cores.
+        # zlib and hashlib release the GIL while working, so threads scale without the
+        # start-up cost of worker processes. Jobs are in archive order and dealt out
+        # round-robin, so the workers move through the file together and reads stay mostly linear.
+        workers = min(os.cpu_count() or 1, len(jobs))
+        checksums = {}
+        if workers > 1:
+            chunks = [jobs[i::workers] for i in range(workers)]
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                for future in [pool.submit(extract_members, str(zip_path), chunk) for chunk in chunks]:
+                    checksums.update(future.result())
+        else:
+            checksums = extract_members(str(zip_path), jobs)
+        # Only once every worker succeeded; on failure extract_dir is removed with all its files
+        extracted_hashes.update(checksums)
         
-        logger.info(f"✓ Extracted: {zip_path.name}")
+        logger.info(f"✓ Extracted: {zip_path.name} ({len(jobs)} media files)")
         return extract_dir
         
+    except ZipBombError as e:
+        logger.error(f"Refusing to extract {zip_path.name}: {e}")
+        # Rename it aside so later scans don't stat, wait on and refuse it again
+        rejected_path = zip_path.with_name(zip_path.name + '.rejected')
+        try:
+            os.rename(zip_path, rejected_path)
+            logger.info(f"  Renamed to {rejected_path.name}")
+        except OSError as e:
+            logger.warning(f"  Failed to rename refused ZIP: {e}")
+        return None
     except zipfile.BadZipFile:
         logger.error(f"Corrupted ZIP file: {zip_path.name}")
         if extract_dir.exists():
@@ -264,101 +399,219 @@ def extract_zip_file(zip_path: Path, user_dir: Path) -> Path | None:
         return None
 
 
-def process_zip_files(user_dir: Path, delete_after: bool) -> int:
+def import_zip(zip_path: Path, user_dir: Path, delete_after: bool) -> Path | None:
+    """
+    Extract one fully written ZIP and, if delete_after, delete it.
+    Returns the extraction directory (not created if the ZIP has no media), or None if extraction failed.
+    """
+    extract_dir = extract_zip_file(zip_path, user_dir)
+    if extract_dir is None:
+        return None
+    
+    # Delete original ZIP file
+    if delete_after:
+        try:
+            zip_path.unlink()
+            logger.info(f"  Deleted ZIP file: {zip_path.name}")
+        except OSError as e:
+            logger.warning(f"  Failed to delete ZIP: {e}")
+    
+    return extract_dir
+
+
+def zip_stability_seconds(size: int) -> int:
+    """How long a ZIP must sit unchanged before it is extracted (longer for 1GB+ files)."""
+    return 30 if size > 1024*1024*1024 else 10
+
+
+def next_zip_ready(users: dict, watch_dir: Path) -> float | None:
+    """
+    When the earliest ZIP that is still too new to extract in any user folder becomes old enough,
+    or None if there is no such ZIP.
+    """
+    now = time.time()
+    ready_times = []
+    for username in users:
+        try:
+            with os.scandir(watch_dir / username) as it:
+                for e in it:
+                    if lower_suffix(e.name) == '.zip' and e.is_file(follow_symlinks=False):
+                        st = e.stat(follow_symlinks=False)
+                        ready_at = st.st_mtime + zip_stability_seconds(st.st_size)
+                        if ready_at > now:
+                            ready_times.append(ready_at)
+        except OSError:
+            continue
+    return min(ready_times, default=None)
+
+
+def process_zip_files(user_dir: Path, delete_after: bool) -> list[Path]:
     """
     Find and extract ZIP files in user directory.
-    Returns the number of ZIP files processed.
+    Returns the list of extraction directories created.
     """
-    zip_files = [f for f in user_dir.iterdir() if f.is_file() and f.suffix.lower() == '.zip']
+    # DirEntry.is_file() answers from the directory read, no stat per entry
+    with os.scandir(user_dir) as it:
+        zip_files = [Path(e.path) for e in it if e.is_file(follow_symlinks=False) and lower_suffix(e.name) == '.zip']
     
     if not zip_files:
-        return 0
+        return []
     
-    processed = 0
+    extract_dirs = []
     for zip_path in zip_files:
         # Use longer stability wait for large files (1GB+)
-        file_size = zip_path.stat().st_size
-        stability_wait = 30 if file_size > 1024*1024*1024 else 10
+        zip_stat = zip_path.stat()
+        stability_wait = zip_stability_seconds(zip_stat.st_size)
         
         # Skip if file is still being written
-        if not is_file_stable(zip_path, stability_seconds=stability_wait):
-            logger.debug(f"Skipping ZIP (still copying): {zip_path.name}")
+        if not is_file_stable(zip_path, stability_seconds=stability_wait, initial_stat=zip_stat):
+            logger.debug("Skipping ZIP (still copying): %s", zip_path.name)
             continue
         
-        # Extract the ZIP
-        extract_dir = extract_zip_file(zip_path, user_dir)
-        if extract_dir is None:
-            continue
-        
-        # Check if it's a Google Takeout and clean it up
-        if is_google_takeout(extract_dir):
-            logger.info(f"  Detected Google Takeout export")
-            cleanup_google_takeout(extract_dir)
-        
-        # Delete original ZIP file
-        if delete_after:
-            try:
-                zip_path.unlink()
-                logger.info(f"  Deleted ZIP file: {zip_path.name}")
-            except OSError as e:
-                logger.warning(f"  Failed to delete ZIP: {e}")
-        
-        processed += 1
+        extract_dir = import_zip(zip_path, user_dir, delete_after)
+        if extract_dir is not None and extract_dir.exists():
+            extract_dirs.append(extract_dir)
     
-    return processed
+    return extract_dirs
 
 
 def calculate_file_hash(file_path: Path) -> str:
     """Calculate SHA1 hash of a file (same algorithm Immich uses)."""
-    sha1 = hashlib.sha1()
-    with open(file_path, 'rb') as f:
-        while chunk := f.read(65536):  # 64KB chunks for better performance
-            sha1.update(chunk)
+    # Checksum for dedup, not security; lets FIPS-restricted OpenSSL builds use their fast path
+    sha1 = hashlib.new('sha1', usedforsecurity=False)
+    # Plain reads, not mmap: a file truncated mid-hash (overwritten over Samba) would
+    # SIGBUS the whole process through a mapping, but just ends a read loop early
+    buf = bytearray(1024 * 1024)
+    view = memoryview(buf)
+    with open(file_path, 'rb', buffering=0) as f:
+        if hasattr(os, 'posix_fadvise'):
+            # One linear pass: ask for aggressive readahead
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        
+        # Reuse one buffer, so no per-chunk allocation
+        while n := f.readinto(buf):
+            sha1.update(view[:n])
     return sha1.hexdigest()
 
 
-def check_duplicates_bulk(file_paths: list[Path], api_key: str, immich_url: str) -> set[str]:
+def try_file_hash(file_path: Path) -> str | None:
+    """
+    SHA1 for the duplicate check: reused from extraction when we wrote the file,
+    otherwise calculate_file_hash. Logs and returns None for files that can't be read.
+    """
+    checksum = extracted_hashes.get(str(file_path))
+    if checksum is not None:
+        return checksum
+    try:
+        return calculate_file_hash(file_path)
+    except OSError as e:
+        logger.warning("Could not hash %s: %s", file_path.name, e)
+        return None
+
+
+class UploadCache:
+    """
+    On-disk record of files already in Immich, keyed by user, deviceAssetId (name + mtime) and size,
+    so rescans of files that weren't deleted skip hashing and uploading them again.
+    Immich deduplicates per user, so one user's upload says nothing about another's library.
+    Only opened when delete_after is off; a hit is never grounds for deleting a file.
+    Does nothing until open() is called. Safe to use from upload threads.
+    """
+    
+    def __init__(self):
+        self._db = None
+        self._lock = threading.Lock()
+    
+    def open(self, db_path: Path):
+        self._db = sqlite3.connect(str(db_path), check_same_thread=False)
+        with self._lock:
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            # Earlier versions kept one table for all users; its rows can't be attributed
+            self._db.execute('DROP TABLE IF EXISTS uploaded')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS imported ('
+                'username TEXT, device_asset_id TEXT, bytes INTEGER, mtime REAL, asset_id TEXT, '
+                'PRIMARY KEY (username, device_asset_id))'
+            )
+            self._db.commit()
+    
+    def contains(self, username: str, key: str, size: int) -> bool:
+        if self._db is None:
+            return False
+        with self._lock:
+            row = self._db.execute(
+                'SELECT 1 FROM imported WHERE username = ? AND device_asset_id = ? AND bytes = ?',
+                (username, key, size)
+            ).fetchone()
+        return row is not None
+    
+    def record(self, username: str, key: str, stat: os.stat_result, asset_id: str | None):
+        if self._db is None:
+            return
+        with self._lock:
+            self._db.execute(
+                'INSERT OR REPLACE INTO imported (username, device_asset_id, bytes, mtime, asset_id) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (username, key, stat.st_size, stat.st_mtime, asset_id)
+            )
+            self._db.commit()
+
+
+upload_cache = UploadCache()
+
+
+@functools.lru_cache(maxsize=None)
+def api_headers(api_key: str) -> dict:
+    """Headers common to every request for a user, built once per API key. Don't mutate the result."""
+    return {
+        'x-api-key': api_key,
+        'Accept': 'application/json'
+    }
+
+
+def device_asset_id(file_path: Path, stat: os.stat_result) -> str:
+    """The deviceAssetId we upload a file under (also the upload cache key)."""
+    return f"{file_path.name}-{stat.st_mtime}"
+
+
+def check_duplicates_bulk(file_paths: list[Path], api_key: str, immich_url: str) -> dict[str, str | None]:
     """
     Check which files already exist in Immich using bulk check API.
-    Returns a set of file paths (as strings) that are duplicates.
+    Returns a dict of duplicate file paths (as strings) to their existing Immich asset ID.
     """
     if not file_paths:
-        return set()
+        return {}
     
-    duplicates = set()
+    duplicates = {}
     
     try:
         url = f"{immich_url}/api/assets/bulk-upload-check"
-        headers = {
-            'x-api-key': api_key,
-            'Content-Type': 'application/json',
-            'Accept': 'application/json'
-        }
+        headers = {**api_headers(api_key), 'Content-Type': 'application/json'}
         
         # Calculate checksums for all files (with progress logging)
         assets = []
         total_files = len(file_paths)
-        logger.info(f"  Hashing {total_files} files...")
+        logger.debug("  Hashing %d files...", total_files)
         
-        for i, file_path in enumerate(file_paths):
-            try:
-                checksum = calculate_file_hash(file_path)
-                assets.append({
-                    'id': str(file_path),
-                    'checksum': checksum
-                })
-            except (OSError, IOError) as e:
-                logger.warning(f"Could not hash {file_path.name}: {e}")
-                continue
-            
-            # Log progress every 500 files
-            if (i + 1) % 500 == 0:
-                logger.info(f"  Hashed {i + 1}/{total_files} files...")
+        # hashlib releases the GIL while hashing, so threads spread this across cores
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            checksums = executor.map(try_file_hash, file_paths)
+            for i, (file_path, checksum) in enumerate(zip(file_paths, checksums)):
+                if checksum is not None:
+                    assets.append({
+                        'id': str(file_path),
+                        'checksum': checksum
+                    })
+                
+                # Log progress every 500 files
+                if (i + 1) % 500 == 0:
+                    logger.info("  Hashed %d/%d files...", i + 1, total_files)
         
         if not assets:
-            return set()
+            return {}
         
-        logger.info(f"  Checking {len(assets)} files against server...")
+        logger.debug("  Checking %d files against server...", len(assets))
         
         # Process in batches of 5000 (same as Immich CLI)
         batch_size = 5000
@@ -368,7 +621,7 @@ def check_duplicates_bulk(file_paths: list[Path], api_key: str, immich_url: str)
             # Longer timeout for large batches
             timeout = max(120, len(batch) // 50)  # At least 2 min, ~20ms per file
             
-            response = requests.post(
+            response = SESSION.post(
                 url, 
                 headers=headers, 
                 json={'assets': batch}, 
@@ -379,152 +632,566 @@ def check_duplicates_bulk(file_paths: list[Path], api_key: str, immich_url: str)
                 result = response.json()
                 for item in result.get('results', []):
                     if item.get('action') == 'reject' and item.get('reason') == 'duplicate':
-                        asset_id = item.get('id', '')
-                        duplicates.add(asset_id)
+                        duplicates[item.get('id', '')] = item.get('assetId')
             else:
                 logger.warning(f"Bulk check failed for batch: {response.status_code} {response.text[:200]}")
         
-        logger.info(f"  Found {len(duplicates)} duplicates, {len(assets) - len(duplicates)} new files")
+        logger.debug("  Found %d duplicates, %d new files", len(duplicates), len(assets) - len(duplicates))
         return duplicates
             
     except requests.exceptions.Timeout:
         logger.warning("Bulk duplicate check timed out - falling back to upload-based dedup")
-        return set()
+        return {}
     except Exception as e:
         logger.warning(f"Bulk duplicate check failed: {e} - falling back to upload-based dedup")
-        return set()
+        return {}
+
 
+def format_timestamp(timestamp: float) -> str:
+    """ISO 8601 UTC timestamp (second precision) for Immich date fields."""
+    # time.strftime on a struct_time skips the tz/microsecond work of datetime.isoformat()
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(timestamp))
 
-def upload_file(file_path: Path, api_key: str, immich_url: str) -> tuple[bool, bool]:
+
+def upload_file(file_path: Path, username: str, api_key: str, immich_url: str,
+                stat: os.stat_result | None = None) -> tuple[bool, bool]:
     """
-    Upload a file to Immich using the API.
+    Upload a file to Immich using the API, as username (whose api_key is given).
+    Pass stat if the caller already has it, to avoid another stat call.
     Returns (success, was_duplicate).
     """
     try:
         url = f"{immich_url}/api/assets"
         
-        headers = {
-            'x-api-key': api_key,
-            'Accept': 'application/json'
-        }
-        
         # Get file stats for metadata
-        stat = file_path.stat()
-        modified_time = datetime.fromtimestamp(stat.st_mtime).isoformat()
+        if stat is None:
+            stat = file_path.stat()
+        modified_time = format_timestamp(stat.st_mtime)
         
         with open(file_path, 'rb') as f:
-            files = {
-                'assetData': (file_path.name, f, 'application/octet-stream')
-            }
-            data = {
-                'deviceAssetId': f"{file_path.name}-{stat.st_mtime}",
-                'deviceId': 'import-watch',
+            # Stream the body as the socket drains instead of building it in memory,
+            # so multi-GB videos don't balloon RSS (and N concurrent uploads stay cheap)
+            body = MultipartEncoder(fields={
+                **_UPLOAD_FIELDS,
+                'deviceAssetId': device_asset_id(file_path, stat),
                 'fileCreatedAt': modified_time,
                 'fileModifiedAt': modified_time,
-                'isFavorite': 'false'
-            }
+                'assetData': (file_path.name, f, 'application/octet-stream')
+            })
+            headers = {**api_headers(api_key), 'Content-Type': body.content_type}
             
-            response = requests.post(url, headers=headers, files=files, data=data, timeout=300)
+            response = SESSION.post(url, headers=headers, data=body, timeout=300)
         
         if response.status_code in (200, 201):
             result = response.json()
             is_duplicate = result.get('duplicate', False)
+            upload_cache.record(username, device_asset_id(file_path, stat), stat, result.get('id'))
             if is_duplicate:
-                logger.info(f"Duplicate skipped: {file_path.name}")
+                logger.info("Duplicate skipped: %s", file_path.name)
             else:
-                logger.info(f"Uploaded: {file_path.name}")
+                logger.info("Uploaded: %s", file_path.name)
             return True, is_duplicate
         else:
-            logger.error(f"Upload failed for {file_path.name}: {response.status_code} - {response.text}")
+            logger.error("Upload failed for %s: %s - %s", file_path.name, response.status_code, response.text)
             return False, False
             
     except requests.exceptions.Timeout:
-        logger.error(f"Timeout uploading {file_path.name}")
+        logger.error("Timeout uploading %s", file_path.name)
         return False, False
     except Exception as e:
-        logger.error(f"Error uploading {file_path.name}: {e}")
+        logger.error("Error uploading %s: %s", file_path.name, e)
         return False, False
 
 
-def process_directory(user_dir: Path, api_key: str, immich_url: str, delete_after: bool) -> tuple[int, int, int]:
-    """Process all files in a user's directory. Returns (uploaded, duplicates, skipped) counts."""
+def is_importable(name: str, suffix: str) -> bool:
+    """Check if a file name (with its lower_suffix) is a media file we should upload."""
+    # Skip hidden files and temp files
+    if name.startswith('.') or name.startswith('~'):
+        return False
+    # Check if supported extension (ZIPs aren't, they're extracted instead)
+    return suffix in SUPPORTED_EXTENSIONS
+
+
+def process_directory(user_dir: Path, api_key: str, immich_url: str, delete_after: bool,
+                      entries: Iterable[Entry] | None = None) -> tuple[int, int, int]:
+    """
+    Process all files in a user's directory. Returns (uploaded, duplicates, skipped) counts.
+    Pass entries from walk_once to reuse a walk the caller already did.
+    """
+    if entries is None:
+        entries = walk_once(user_dir)
+    
+    # Collect all supported files, keeping only those that are stable (not actively being written)
+    candidates = list(entries)
+    if not candidates:
+        return 0, 0, 0
+    
+    logger.info(f"Processing {len(candidates)} files for {user_dir.name}...")
+    stable, skipped = filter_stable(candidates)
+    
+    all_files = [e.path for e in stable]
+    # Stats gathered by the walk, reused for the upload metadata
+    stat_cache = {e.path: e.stat for e in stable}
+    
+    uploaded, duplicates, _ = upload_files(all_files, user_dir, api_key, immich_url, delete_after, stat_cache)
+    return uploaded, duplicates, skipped
+
+
+def batch_by_size(files: list[Path], stat_cache: dict[Path, os.stat_result], max_bytes: int):
+    """Yield consecutive slices of files whose sizes add up to about max_bytes (at least one file each)."""
+    batch = []
+    batch_bytes = 0
+    for file_path in files:
+        batch.append(file_path)
+        batch_bytes += stat_cache[file_path].st_size
+        if batch_bytes >= max_bytes:
+            yield batch
+            batch = []
+            batch_bytes = 0
+    if batch:
+        yield batch
+
+
+def upload_files(all_files: list[Path], user_dir: Path, api_key: str, immich_url: str, delete_after: bool,
+                 stat_cache: dict[Path, os.stat_result] | None = None) -> tuple[int, int, list[Path]]:
+    """
+    Upload files that are known to be fully written.
+    Returns (uploaded, duplicates) counts and the files whose upload failed.
+    stat_cache holds stats already taken this scan; files missing from it are stat'd on upload.
+    """
+    if stat_cache is None:
+        stat_cache = {}
+    username = user_dir.name
+    
     uploaded = 0
     duplicates = 0
-    skipped = 0
-    
-    # Collect all supported files first
-    all_files = []
-    for file_path in user_dir.rglob('*'):
-        if not file_path.is_file():
-            continue
-        # Skip hidden files, temp files, and zip files
-        if file_path.name.startswith('.') or file_path.name.startswith('~'):
-            continue
-        if file_path.suffix.lower() == '.zip':
-            continue
-        # Check if supported extension
-        if file_path.suffix.lower() not in SUPPORTED_EXTENSIONS:
-            continue
-        # Wait for file to be stable (not actively being written)
-        if not is_file_stable(file_path):
-            logger.debug(f"Skipping (still copying): {file_path.name}")
-            skipped += 1
-            continue
-        all_files.append(file_path)
+    failed = []
+    # Parents of deleted files, pruned once at the end rather than after every delete
+    deleted_parents = set()
     
     if not all_files:
-        return uploaded, duplicates, skipped
-    
-    # Check for duplicates in bulk (much faster than checking one by one)
-    duplicate_paths = check_duplicates_bulk(all_files, api_key, immich_url)
+        return uploaded, duplicates, failed
     
+    # Files an earlier scan already got into Immich need no hashing or upload
+    # (only kept files are ever cached; deletes always go through the server check)
+    to_check = []
     for file_path in all_files:
-        # Skip if file was already deleted
-        if not file_path.exists():
-            continue
+        stat = stat_cache.get(file_path)
+        if stat is None:
+            try:
+                stat = stat_cache[file_path] = file_path.stat()
+            except OSError:
+                continue  # Already deleted
         
-        # Check if this file is a duplicate (already in Immich)
-        if str(file_path) in duplicate_paths:
+        if upload_cache.contains(username, device_asset_id(file_path, stat), stat.st_size):
             duplicates += 1
-            if delete_after:
-                try:
-                    file_path.unlink()
-                    cleanup_empty_parents(file_path, user_dir)
-                except Exception as e:
-                    logger.error(f"Error deleting duplicate {file_path.name}: {e}")
+            release_imported(file_path, delete_after)
             continue
         
-        # Try to upload
-        success, was_duplicate = upload_file(file_path, api_key, immich_url)
-        if success:
-            if was_duplicate:
-                duplicates += 1
+        to_check.append(file_path)
+    
+    def finish(futures: dict):
+        """Count a slice's finished uploads and release the imported files."""
+        nonlocal uploaded, duplicates
+        for future in as_completed(futures):
+            file_path = futures[future]
+            success, was_duplicate = future.result()
+            if success:
+                if was_duplicate:
+                    duplicates += 1
+                else:
+                    uploaded += 1
+                if release_imported(file_path, delete_after):
+                    deleted_parents.add(file_path.parent)
             else:
-                uploaded += 1
-            if delete_after:
-                try:
-                    file_path.unlink()
-                    cleanup_empty_parents(file_path, user_dir)
-                except Exception as e:
-                    logger.error(f"Error deleting {file_path.name}: {e}")
+                failed.append(file_path)
     
-    return uploaded, duplicates, skipped
+    # Hash-check and upload a page-cache-sized slice at a time, so the upload re-reads what
+    # hashing just pulled into memory instead of going back to disk. The next slice is hashed
+    # and checked while this one uploads (never further ahead), so neither side sits idle.
+    batches = list(batch_by_size(to_check, stat_cache, CHECK_BATCH_BYTES))
+    # Uploads are network-bound, so overlap them; the pool size bounds open files and connections
+    with ThreadPoolExecutor(max_workers=CONCURRENT_UPLOADS) as executor, \
+            ThreadPoolExecutor(max_workers=1) as checker:
+        uploading = {}
+        next_check = checker.submit(check_duplicates_bulk, batches[0], api_key, immich_url) if batches else None
+        for i, batch in enumerate(batches):
+            # Check for duplicates in bulk (much faster than checking one by one)
+            duplicate_paths = next_check.result()
+            
+            to_upload = []
+            for file_path in batch:
+                # Check if this file is a duplicate (already in Immich)
+                if str(file_path) in duplicate_paths:
+                    duplicates += 1
+                    upload_cache.record(username, device_asset_id(file_path, stat_cache[file_path]),
+                                        stat_cache[file_path], duplicate_paths[str(file_path)])
+                    if release_imported(file_path, delete_after):
+                        deleted_parents.add(file_path.parent)
+                    continue
+                
+                to_upload.append(file_path)
+            
+            # Queued behind the previous slice, so the pool stays busy through its slowest upload
+            previous = uploading
+            uploading = {executor.submit(upload_file, file_path, username, api_key, immich_url, stat_cache.get(file_path)): file_path for file_path in to_upload}
+            
+            finish(previous)
+            if i + 1 < len(batches):
+                next_check = checker.submit(check_duplicates_bulk, batches[i + 1], api_key, immich_url)
+        
+        finish(uploading)
+    
+    remove_empty_dirs(deleted_parents, user_dir)
+    
+    return uploaded, duplicates, failed
+
+
+def release_imported(file_path: Path, delete_after: bool) -> bool:
+    """
+    Finish with a file that is now in Immich: delete it if delete_after, otherwise
+    just forget its extraction hash. Returns True if it was deleted.
+    """
+    if delete_after:
+        return delete_imported(file_path)
+    extracted_hashes.pop(str(file_path), None)
+    return False
+
+
+def delete_imported(file_path: Path) -> bool:
+    """Delete a file that is now in Immich. Returns True if it was deleted."""
+    path_str = str(file_path)
+    extracted_hashes.pop(path_str, None)
+    try:
+        os.unlink(path_str)  # Called once per imported file; skips Path's method dispatch
+        return True
+    except Exception as e:
+        logger.error("Error deleting %s: %s", file_path.name, e)
+        return False
 
 
-def cleanup_empty_parents(file_path: Path, stop_at: Path):
-    """Remove empty parent directories up to stop_at."""
-    parent = file_path.parent
-    while parent != stop_at and parent.exists():
+def remove_empty_dirs(dirs: set[Path], stop_at: Path):
+    """Remove empty directories and their empty parents up to (not including) stop_at, deepest first."""
+    candidates = set()
+    for dir_path in dirs:
+        # Stop climbing at the first ancestor another directory already added
+        while dir_path not in candidates and dir_path != stop_at and dir_path.is_relative_to(stop_at):
+            candidates.add(dir_path)
+            dir_path = dir_path.parent
+    
+    for dir_path in sorted(candidates, key=lambda p: len(p.parts), reverse=True):
         try:
-            contents = list(parent.iterdir())
-            if not contents:
-                parent.rmdir()
-                logger.debug(f"Removed empty directory: {parent}")
-            else:
-                break
+            os.rmdir(dir_path)  # Only removes if empty
+            logger.debug("Removed empty directory: %s", dir_path)
         except OSError:
+            pass
+
+
+def scan_user(username: str, api_key: str, watch_dir: Path, immich_url: str, delete_after: bool) -> tuple:
+    """Scan one user's directory: extract ZIPs, then upload anything new.
+    
+    Returns (zips, uploaded, duplicates, skipped).
+    """
+    user_dir = watch_dir / username
+    
+    if not user_dir.exists():
+        return 0, 0, 0, 0
+    
+    # First, process any ZIP files (extract them)
+    extract_dirs = process_zip_files(user_dir, delete_after)
+    
+    # Upload whatever is there (process_directory returns early when nothing is importable)
+    uploaded, duplicates, skipped = process_directory(user_dir, api_key, immich_url, delete_after)
+    return len(extract_dirs), uploaded, duplicates, skipped
+
+
+def scan_users(users: dict, watch_dir: Path, immich_url: str, delete_after: bool):
+    """Run one full scan of every user's directory, one thread per user."""
+    total_uploaded = 0
+    total_duplicates = 0
+    total_skipped = 0
+    total_zips = 0
+    
+    # Users are independent, so one big import doesn't hold up everyone else's
+    with ThreadPoolExecutor(max_workers=max(1, len(users))) as executor:
+        futures = {
+            executor.submit(scan_user, username, api_key, watch_dir, immich_url, delete_after): username
+            for username, api_key in users.items()
+        }
+        for future in as_completed(futures):
+            try:
+                zips, uploaded, duplicates, skipped = future.result()
+            except Exception as e:
+                logger.error(f"Error scanning files for {futures[future]}: {e}")
+                continue
+            total_zips += zips
+            total_uploaded += uploaded
+            total_duplicates += duplicates
+            total_skipped += skipped
+    
+    if total_zips > 0:
+        logger.info(f"Extracted {total_zips} ZIP file(s)")
+    if total_uploaded > 0 or total_duplicates > 0 or total_skipped > 0:
+        logger.info(f"Scan complete. Uploaded: {total_uploaded}, Duplicates: {total_duplicates}, Still copying: {total_skipped}")
+
+
+def create_inotify_watcher(watch_dir: Path):
+    """
+    Set up a recursive inotify watch on the watch directory.
+    Returns None if inotify is unavailable (non-Linux, package missing, watch limit hit).
+    """
+    if sys.platform != 'linux' or inotify is None:
+        return None
+    
+    try:
+        mask = inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO
+        return inotify.adapters.InotifyTree(str(watch_dir), mask=mask)
+    except Exception as e:
+        logger.warning(f"Could not start inotify watcher: {e}")
+        return None
+
+
+def import_queued(username: str, files: set[Path], zips: set[Path], settled_dirs: list[Path], retry: dict,
+                  api_key: str, watch_dir: Path, immich_url: str, delete_after: bool, retry_seconds: int):
+    """
+    Import one user's queued files, ZIPs and settled new directories.
+    Anything that fails to import is added to retry (path -> time to try again).
+    """
+    user_dir = watch_dir / username
+    
+    # Every file to import, with its stat (walked files reuse the DirEntry stat);
+    # names are checked once on the way in, so everything here is importable
+    stat_cache = {}
+    
+    extracted = 0
+    no_media = 0
+    for zip_path in sorted(z for z in zips if z.exists()):
+        extract_dir = import_zip(zip_path, user_dir, delete_after)
+        if extract_dir is None:
+            # Refused bombs are renamed aside; anything still here gets another try
+            if zip_path.exists():
+                retry[zip_path] = time.time() + retry_seconds
+        elif extract_dir.exists():
+            extracted += 1
+            # Extracted files land before inotify can watch the new directory,
+            # so pick them up directly instead of waiting for events
+            stat_cache.update((e.path, e.stat) for e in walk_once(extract_dir))
+        else:
+            no_media += 1
+    if extracted:
+        logger.info(f"Extracted {extracted} ZIP file(s) for {username}")
+    if no_media:
+        logger.info(f"Found no media in {no_media} ZIP file(s) for {username}")
+    
+    skipped = 0
+    for dir_path in settled_dirs:
+        candidates = list(walk_once(dir_path))
+        # Files still copying are skipped here; their IN_CLOSE_WRITE will queue them later
+        stable, dir_skipped = filter_stable(candidates)
+        stat_cache.update((e.path, e.stat) for e in stable)
+        skipped += dir_skipped
+    
+    # Files from events need one stat, which doubles as the "still there?" check
+    for file_path in files:
+        if file_path not in stat_cache and is_importable(file_path.name, lower_suffix(file_path.name)):
+            try:
+                stat_cache[file_path] = file_path.stat()
+            except OSError:
+                pass
+    
+    ready = sorted(stat_cache)
+    if not ready:
+        return
+    
+    logger.info(f"Processing {len(ready)} files for {username}...")
+    uploaded, duplicates, failed = upload_files(ready, user_dir, api_key, immich_url, delete_after, stat_cache)
+    logger.info(f"Import complete. Uploaded: {uploaded}, Duplicates: {duplicates}, Still copying: {skipped}")
+    
+    # No new event will come for these (e.g. Immich was restarting), so retry them ourselves
+    if failed:
+        retry_at = time.time() + retry_seconds
+        retry.update((file_path, retry_at) for file_path in failed)
+        logger.info(f"Retrying {len(failed)} failed upload(s) for {username} in {retry_seconds}s")
+
+
+def flush_pending(pending: dict, users: dict, watch_dir: Path, immich_url: str, delete_after: bool,
+                  retry_seconds: int):
+    """
+    Import everything queued by inotify events since the last flush, one thread per user with work.
+    Files and ZIPs that fail to import are queued again to be retried after retry_seconds.
+    """
+    now = time.time()
+    work = {}
+    for username, queued in pending.items():
+        # Failures whose retry is due go back in with the new arrivals
+        for path, due in list(queued['retry'].items()):
+            if due <= now:
+                del queued['retry'][path]
+                queued['zips' if lower_suffix(path.name) == '.zip' else 'files'].add(path)
+        
+        # New directories may contain files written before their watch existed,
+        # so give them time to settle and then sweep them with the stability check
+        settled_dirs = [d for d, seen in queued['dirs'].items() if now - seen >= FILE_STABILITY_SECONDS]
+        
+        if not queued['files'] and not queued['zips'] and not settled_dirs:
+            continue
+        
+        work[username] = (queued['files'], queued['zips'], settled_dirs)
+        queued['files'] = set()
+        queued['zips'] = set()
+        for d in settled_dirs:
+            del queued['dirs'][d]
+    
+    if not work:
+        return
+    
+    # Users are independent, so one big import doesn't hold up everyone else's
+    with ThreadPoolExecutor(max_workers=len(work)) as executor:
+        futures = {
+            executor.submit(import_queued, username, files, zips, settled_dirs, pending[username]['retry'],
+                            users[username], watch_dir, immich_url, delete_after, retry_seconds): username
+            for username, (files, zips, settled_dirs) in work.items()
+        }
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Error importing files for {futures[future]}: {e}")
+
+
+def watch_with_inotify(tree, users: dict, watch_dir: Path, immich_url: str, delete_after: bool, scan_interval: int):
+    """
+    Block on inotify events and import files as soon as they finish landing.
+    Failed uploads and extractions are retried every scan_interval until they succeed or the file goes away.
+    Falls back to watch_with_polling if the watch can't be kept up (e.g. the watch limit is hit).
+    """
+    pending = {username: {'files': set(), 'zips': set(), 'dirs': {}, 'retry': {}} for username in users}
+    last_event = 0.0
+    batch_started = None
+    
+    while True:
+        try:
+            # yield_nones hands us a tick after every poll (at least once a second);
+            # the queued batch is imported once events go quiet, or after a long
+            # burst so a big copy is imported as it goes rather than only at the end
+            for event in tree.event_gen(yield_nones=True):
+                if event is None:
+                    now = time.time()
+                    if now - last_event >= INOTIFY_QUIET_SECONDS or (
+                            batch_started is not None and now - batch_started >= INOTIFY_MAX_BATCH_SECONDS):
+                        flush_pending(pending, users, watch_dir, immich_url, delete_after, scan_interval)
+                        batch_started = None
+                    continue
+                
+                _, type_names, path, filename = event
+                is_dir = 'IN_ISDIR' in type_names
+                if not filename:
+                    continue
+                if is_dir and filename.startswith('_extracted_'):
+                    continue  # Our own ZIP extraction, handled directly
+                if is_dir and 'IN_CREATE' not in type_names and 'IN_MOVED_TO' not in type_names:
+                    continue
+                if not is_dir and INOTIFY_FILE_EVENTS.isdisjoint(type_names):
+                    continue
+                
+                # Map the event back to the user folder it happened in
+                event_path = Path(path) / filename
+                try:
+                    username = event_path.relative_to(watch_dir).parts[0]
+                except (ValueError, IndexError):
+                    continue
+                if username not in pending or event_path.parent == watch_dir:
+                    continue
+                
+                last_event = time.time()
+                if batch_started is None:
+                    batch_started = last_event
+                
+                if is_dir:
+                    pending[username]['dirs'][event_path] = last_event
+                elif lower_suffix(filename) == '.zip':
+                    if event_path.parent == watch_dir / username:
+                        pending[username]['zips'].add(event_path)
+                else:
+                    pending[username]['files'].add(event_path)
+        
+        except inotify.adapters.TerminalEventException as e:
+            # Queue overflow or unmount: events were lost, so rebuild the watch and rescan
+            logger.warning(f"inotify reported {e}, rebuilding watch and rescanning")
+        except inotify.calls.InotifyError as e:
+            # Raised from inside event_gen when a new folder can't be watched (max_user_watches)
+            logger.warning(f"inotify watch failed: {e}")
+            break
+        
+        # Release the old watches before adding new ones, so the rebuild doesn't need twice the limit
+        tree = None
+        tree = create_inotify_watcher(watch_dir)
+        if tree is None:
             break
-        parent = parent.parent
+        scan_users(users, watch_dir, immich_url, delete_after)
+    
+    tree = None
+    logger.warning(f"Falling back to polling every {scan_interval}s")
+    watch_with_polling(users, watch_dir, immich_url, delete_after, scan_interval)
+
+
+def start_scan_kicker(users: dict, watch_dir: Path) -> threading.Event:
+    """
+    Watch just the top level of each user directory and set the returned event when
+    something lands there, so polling mode can scan early instead of sleeping it out.
+    Without inotify the event is never set and polling runs on its interval alone.
+    """
+    wake = threading.Event()
+    if sys.platform != 'linux' or inotify is None:
+        return wake
+    
+    try:
+        # Non-recursive, one watch per user, so this works even where InotifyTree hit the watch limit.
+        # IN_CREATE catches folders copied in, whose own files land out of sight of this watch.
+        notifier = inotify.adapters.Inotify()
+        mask = inotify.constants.IN_CLOSE_WRITE | inotify.constants.IN_MOVED_TO | inotify.constants.IN_CREATE
+        for username in users:
+            notifier.add_watch(str(watch_dir / username), mask=mask)
+    except Exception as e:
+        logger.warning(f"Could not start inotify scan trigger: {e}")
+        return wake
+    
+    def kick():
+        try:
+            for _, _, _, filename in notifier.event_gen(yield_nones=False):
+                # Our own extraction directories are imported by the scan that made them
+                if not filename.startswith('_extracted_'):
+                    wake.set()
+        except Exception as e:
+            logger.warning(f"inotify scan trigger stopped: {e}")
+    
+    threading.Thread(target=kick, name='scan-kicker', daemon=True).start()
+    return wake
+
+
+def watch_with_polling(users: dict, watch_dir: Path, immich_url: str, delete_after: bool, scan_interval: int):
+    """Rescan every user directory on a fixed interval, or sooner when a drop is noticed."""
+    wake = start_scan_kicker(users, watch_dir)
+    
+    while True:
+        try:
+            scan_users(users, watch_dir, immich_url, delete_after)
+        except Exception as e:
+            logger.error(f"Error during scan: {e}")
+        
+        # A ZIP the scan found too new to extract is retried as soon as it's old enough,
+        # rather than a whole interval later
+        timeout = scan_interval
+        ready_at = next_zip_ready(users, watch_dir)
+        if ready_at is not None:
+            timeout = min(timeout, ready_at - time.time())
+        
+        if wake.wait(timeout):
+            # Let the drop go quiet long enough to pass the stability check (bounded by the interval)
+            deadline = time.time() + scan_interval
+            wake.clear()
+            while wake.wait(FILE_STABILITY_SECONDS) and time.time() < deadline:
+                wake.clear()
 
 
 def main():
@@ -551,53 +1218,36 @@ def main():
     logger.info(f"Watch directory: {watch_dir}")
     logger.info(f"Immich URL: {immich_url}")
     logger.info(f"Scan interval: {scan_interval}s")
+    logger.info(f"Concurrent uploads: {CONCURRENT_UPLOADS}")
     logger.info(f"Delete after import: {delete_after}")
     logger.info(f"Configured users: {list(users.keys())}")
     
+    # Remember what has been uploaded across restarts (lives beside the user folders).
+    # Only when files are kept: imported files are otherwise gone, so a cache hit could only
+    # come from a re-drop, and trusting it would delete a file Immich may no longer have.
+    if not delete_after:
+        upload_cache.open(watch_dir / '.importwatch.db')
+    
     # Create user directories if they don't exist
     for username in users.keys():
         user_dir = watch_dir / username
         user_dir.mkdir(parents=True, exist_ok=True)
         logger.info(f"Watching: {user_dir}")
     
-    # Main loop
-    while True:
+    # Prefer kernel file events; fall back to polling where inotify isn't available
+    tree = create_inotify_watcher(watch_dir)
+    
+    if tree is None:
+        logger.info(f"Watch mode: polling every {scan_interval}s")
+        watch_with_polling(users, watch_dir, immich_url, delete_after, scan_interval)
+    else:
+        logger.info("Watch mode: inotify")
+        # Catch anything that landed while the watcher wasn't running
         try:
-            total_uploaded = 0
-            total_duplicates = 0
-            total_skipped = 0
-            total_zips = 0
-            
-            for username, api_key in users.items():
-                user_dir = watch_dir / username
-                
-                if not user_dir.exists():
-                    continue
-                
-                # First, process any ZIP files (extract them)
-                zips_processed = process_zip_files(user_dir, delete_after)
-                total_zips += zips_processed
-                
-                # Check if there are any files to upload
-                files = list(user_dir.rglob('*'))
-                file_count = sum(1 for f in files if f.is_file() and not f.name.startswith('.') and f.suffix.lower() != '.zip')
-                
-                if file_count > 0:
-                    logger.info(f"Processing {file_count} files for {username}...")
-                    uploaded, duplicates, skipped = process_directory(user_dir, api_key, immich_url, delete_after)
-                    total_uploaded += uploaded
-                    total_duplicates += duplicates
-                    total_skipped += skipped
-            
-            if total_zips > 0:
-                logger.info(f"Extracted {total_zips} ZIP file(s)")
-            if total_uploaded > 0 or total_duplicates > 0 or total_skipped > 0:
-                logger.info(f"Scan complete. Uploaded: {total_uploaded}, Duplicates: {total_duplicates}, Still copying: {total_skipped}")
-            
+            scan_users(users, watch_dir, immich_url, delete_after)
         except Exception as e:
             logger.error(f"Error during scan: {e}")
-        
-        time.sleep(scan_interval)
+        watch_with_inotify(tree, users, watch_dir, immich_url, delete_after, scan_interval)
 
 if __name__ == '__main__':
     main()